@@ -17,13 +17,34 @@ Usage example::
 
 """
 
-from fastapi import Header, HTTPException, status
+import hashlib
+from functools import lru_cache
+from fastapi import Depends, Header, HTTPException, status
 from typing import Optional
 
-from .config import get_settings
+from .config import Settings, get_settings
 
 
-async def get_current_identity(x_api_key: Optional[str] = Header(None, alias="X-API-Key")) -> str:
+def _digest(key: str) -> bytes:
+    """Return the SHA‑256 digest of an API key."""
+    return hashlib.sha256(key.encode()).digest()
+
+
+@lru_cache(maxsize=1)
+def _allowed_digests(keys: frozenset[str]) -> frozenset[bytes]:
+    """Return the digests of the configured API keys.
+
+    Keys are compared as fixed-length digests so that the time taken by a
+    lookup does not depend on the length or prefix of the configured keys.
+    The result is cached per set of keys, so it is only built once.
+    """
+    return frozenset(_digest(k) for k in keys)
+
+
+async def get_current_identity(
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    settings: Settings = Depends(get_settings),
+) -> str:
     """Return the caller's identity after validating the API key.
 
     If no API keys are configured in ``API_KEYS``, authentication is disabled
@@ -35,6 +56,9 @@ async def get_current_identity(x_api_key: Optional[str] = Header(None, alias="X-
     ----------
     x_api_key: Optional[str]
         The value of the ``X-API-Key`` header sent by the client.
+    settings: Settings
+        Service settings, injected by FastAPI so that tests and callers can
+        supply their own through ``app.dependency_overrides``.
 
     Returns
     -------
@@ -42,8 +66,7 @@ async def get_current_identity(x_api_key: Optional[str] = Header(None, alias="X-
         The trimmed API key used to authenticate the request.  This value
         functions as the caller's identity for the purpose of rate limiting.
     """
-    settings = get_settings()
-    allowed_keys = settings.parsed_api_keys
+    allowed_keys = settings.api_keys
     # If no keys configured, skip authentication entirely
     if not allowed_keys:
         return ""
@@ -54,7 +77,7 @@ async def get_current_identity(x_api_key: Optional[str] = Header(None, alias="X-
             headers={"WWW-Authenticate": "API key"},
         )
     key = x_api_key.strip()
-    if key not in allowed_keys:
+    if _digest(key) not in _allowed_digests(allowed_keys):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
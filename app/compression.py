@@ -6,12 +6,13 @@ alongside the number of tokens before and after compression, which are
 useful for rate limiting and logging.
 """
 
-from typing import Tuple
+from typing import Optional, Tuple
 
+from .config import Settings, get_settings
 from .services import qr_retriever
 
 
-def compress(query: str, context: str) -> Tuple[str, int, int]:
+def compress(query: str, context: str, *, settings: Optional[Settings] = None) -> Tuple[str, int, int]:
     """Run the QR‑HEAD reducer to condense context.
 
     Parameters
@@ -20,6 +21,9 @@ def compress(query: str, context: str) -> Tuple[str, int, int]:
         The user's current query.
     context: str
         Concatenation of previous messages (if any).
+    settings: Optional[Settings]
+        Settings already loaded for the current request; when omitted,
+        :func:`app.config.get_settings` is consulted.
 
     Returns
     -------
@@ -27,5 +31,7 @@ def compress(query: str, context: str) -> Tuple[str, int, int]:
         The condensed context, the number of tokens before compression,
         and the number of tokens after compression.
     """
-    condensed, before, after = qr_retriever.reduce(query, context)
+    if settings is None:
+        settings = get_settings()
+    condensed, before, after = qr_retriever.reduce(query, context, top_k=settings.top_k)
     return condensed, before, after
\ No newline at end of file
@@ -4,14 +4,18 @@ This module centralises all environment variables used by the service.  The
 defaults defined here are sensible for local development.  In production
 environments you should override these values via environment variables.
 """
-from functools import lru_cache
-from pydantic_settings import BaseSettings
-from pydantic import Field
+from functools import cached_property, lru_cache
+from typing import Annotated, Any
+from pydantic_settings import BaseSettings, NoDecode
+from pydantic import Field, field_validator
 
 
 class Settings(BaseSettings):
-    # API keys allowed to access this service.  Comma‑separated list.
-    api_keys: str = Field("dev-key", env="API_KEYS")
+    # API keys allowed to access this service.  Comma‑separated list in the
+    # environment, parsed once into a set of stripped keys.
+    api_keys: Annotated[frozenset[str], NoDecode] = Field(
+        "dev-key", env="API_KEYS", validate_default=True
+    )
     # Upstream provider base URL (e.g. https://api.openai.com)
     upstream_base: str = Field("https://api.openai.com", env="UPSTREAM_BASE")
     # Default model name used when none is provided by the caller
@@ -37,10 +41,21 @@ class Settings(BaseSettings):
     # Database file path for storing conversation memory
     database_url: str = Field("sqlite:///./memory.db", env="DATABASE_URL")
 
-    @property
-    def parsed_api_keys(self) -> set[str]:
-        """Return the configured API keys as a set of stripped strings."""
-        return {k.strip() for k in self.api_keys.split(",") if k.strip()}
+    @field_validator("api_keys", mode="before")
+    @classmethod
+    def _split_api_keys(cls, value: Any) -> Any:
+        """Parse a comma‑separated string of keys into a frozenset."""
+        if isinstance(value, str):
+            return frozenset(k.strip() for k in value.split(",") if k.strip())
+        return value
+
+    # Values derived from the fields above are computed on first access and
+    # cached on the instance, since they are read on every request.
+
+    @cached_property
+    def upstream_url(self) -> str:
+        """Return the full URL of the upstream chat completions endpoint."""
+        return self.upstream_base.rstrip("/") + "/v1/chat/completions"
 
 
 @lru_cache
@@ -24,21 +24,34 @@ headers ``x-tokens-before``, ``x-tokens-after`` and ``x-tokens-saved``
 to report compression metrics.
 """
 
-from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
-from fastapi.responses import JSONResponse, StreamingResponse
-import json
+from fastapi.responses import StreamingResponse
+import anyio
+import orjson
 
 from .auth import get_current_identity
 from .rate_limit import get_rate_limiter
 from .compression import compress
-from .memory import add_message, get_context
-from .upstream import call_llm
-from .config import get_settings
+from .memory import add_messages, get_context
+from .upstream import call_llm, close_client
+from .config import Settings, get_settings
+from .services import qr_retriever
 
 
-app = FastAPI(title="MemoryOps LLM Proxy")
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Load the QR‑HEAD model now rather than on the first request.  This
+    # blocks, so run it in a worker thread to keep the event loop free.
+    await anyio.to_thread.run_sync(qr_retriever.warm_up)
+    yield
+    # Release the pooled upstream connections
+    await close_client()
+
+
+app = FastAPI(title="MemoryOps LLM Proxy", lifespan=lifespan)
 
 # Instantiate rate limiter once
 limiter = get_rate_limiter()
@@ -47,16 +60,15 @@ limiter = get_rate_limiter()
 @app.post("/v1/chat/completions")
 async def chat_completions(
     request: Request,
-    response: Response,
     identity: str = Depends(get_current_identity),
     authorization: Optional[str] = Header(None, alias="Authorization"),
     x_session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+    settings: Settings = Depends(get_settings),
 ) -> Response:
     """Handle chat completion requests in OpenAI format."""
-    settings = get_settings()
     # Parse JSON body
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
     # Validate required fields
@@ -78,7 +90,7 @@ async def chat_completions(
         raise HTTPException(status_code=422, detail="Last message must have role 'user'")
     query = current_msg.get("content", "")
     # Compress context relative to query
-    condensed_context, tokens_before, tokens_after = compress(query, context)
+    condensed_context, tokens_before, tokens_after = compress(query, context, settings=settings)
     # Rate limit using tokens_before (worst case consumption)
     limiter.check(identity, tokens_before)
     # Build new messages for upstream: previous condensed context + current messages
@@ -96,26 +108,31 @@ async def chat_completions(
         model=model,
         stream=stream,
         authorization=authorization,
+        settings=settings,
     )
     # Save messages to memory for future context (non‑streaming case only)
     # Compute tokens used as after compression to approximate consumption
-    add_message(session_id, role="user", content=query, tokens=tokens_after)
-    # For assistant reply, we approximate tokens by length of choices
-    if not stream and isinstance(result, dict):
-        choices = result.get("choices", [])
+    rows = [("user", query, tokens_after)]
+    # For assistant reply, we approximate tokens by length of choices.  The
+    # upstream body is parsed once here and otherwise forwarded untouched.
+    reply = None if stream else orjson.loads(result)
+    if isinstance(reply, dict):
+        choices = reply.get("choices", [])
         if choices:
             reply_content = choices[0].get("message", {}).get("content", "")
             reply_tokens = len(reply_content.split())  # naive token count
-            add_message(session_id, role="assistant", content=reply_content, tokens=reply_tokens)
-    # Set custom headers for compression stats
-    response.headers["x-tokens-before"] = str(tokens_before)
-    response.headers["x-tokens-after"] = str(tokens_after)
-    response.headers["x-tokens-saved"] = str(tokens_before - tokens_after)
-    # Non streaming: return JSON directly
+            rows.append(("assistant", reply_content, reply_tokens))
+    # Both rows are written in a single transaction
+    add_messages(session_id, rows)
+    # Custom headers for compression stats.  These must be passed to the
+    # response we return; headers set on an injected Response are dropped.
+    headers = {
+        "x-tokens-before": str(tokens_before),
+        "x-tokens-after": str(tokens_after),
+        "x-tokens-saved": str(tokens_before - tokens_after),
+    }
+    # Non streaming: pass the upstream JSON bytes through unchanged
     if not stream:
-        return JSONResponse(status_code=200, content=result)
-    # Streaming: convert event generator to streaming response
-    async def event_stream():
-        async for event in result:
-            yield f"data: {json.dumps(event)}\n\n"
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+        return Response(content=result, media_type="application/json", headers=headers)
+    # Streaming: relay the upstream SSE bytes unchanged
+    return StreamingResponse(result, media_type="text/event-stream", headers=headers)
\ No newline at end of file
@@ -3,17 +3,38 @@
 This module defines a simple persistence layer for storing and retrieving
 messages exchanged with the LLM.  Messages are associated with a
 ``session_id`` so that each conversation can be isolated.  The
-implementation uses SQLAlchemy for portability and ease of use.
+implementation talks to SQLite directly through the standard library
+:mod:`sqlite3` module; the statements involved are trivial and an ORM adds
+nothing but per-call overhead.
+
+All state lives in a :class:`Store` bound to one database.  Its
+connections are opened once and configured for write‑ahead logging (WAL):
+a single writer connection, serialised with a lock (SQLite serialises
+writes anyway), and a small pool of reader connections that can run
+alongside it without blocking.  The module-level functions below operate
+on a default store for ``DATABASE_URL``, created on first use.
+
+Concatenated contexts are cached per session and kept up to date by the
+write functions, so repeated :func:`get_context` calls for an active
+session do not touch the database.  The cache assumes this process owns
+all writes; it will go stale if other processes write to the same file.
 
 For single‑process deployments, SQLite is sufficient.  When scaling the
-service across multiple processes or machines, switch to a central
-database by setting the ``DATABASE_URL`` environment variable.
+service across multiple processes or machines, point ``DATABASE_URL`` at
+a shared volume or replace this module with a client for a central
+database.
 
 Functions
 ---------
+get_store() -> Store
+    Return the default store, creating it on first use.
+
 add_message(session_id: str, role: str, content: str, tokens: int) -> None
     Persist a new message.
 
+add_messages(session_id: str, rows: Iterable[tuple[str, str, int]]) -> None
+    Persist several messages in a single transaction.
+
 get_messages(session_id: str) -> list[dict]
     Retrieve messages for a session in insertion order.
 
@@ -24,72 +45,282 @@ clear_session(session_id: str) -> None
     Delete all messages for a session.
 """
 
-from typing import List
-from sqlalchemy import Column, Integer, String, Text, create_engine, select, delete
-from sqlalchemy.orm import declarative_base, sessionmaker
+import queue
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from .config import get_settings
 
-Base = declarative_base()
 
+def _sqlite_path(database_url: str) -> str:
+    """Translate a ``sqlite:///path`` URL into a path for :func:`sqlite3.connect`.
 
-class Message(Base):
-    """ORM model representing a single chat message."""
+    ``sqlite:///:memory:`` and the bare ``sqlite://`` both mean an in-memory
+    database.  A private ``:memory:`` database would give every connection
+    of a store its own empty copy, so they are mapped to a uniquely named
+    shared-cache URI that all of the store's connections open together.
+    """
+    scheme, sep, rest = database_url.partition("://")
+    if not sep or not scheme.startswith("sqlite"):
+        raise ValueError(f"Unsupported DATABASE_URL: {database_url!r}")
+    if rest and not rest.startswith("/"):
+        raise ValueError(f"Unsupported DATABASE_URL: {database_url!r}")
+    path = rest[1:]
+    if path in ("", ":memory:"):
+        return f"file:memdb-{uuid.uuid4().hex}?mode=memory&cache=shared"
+    return path
 
-    __tablename__ = "messages"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String, index=True, nullable=False)
-    role = Column(String, nullable=False)  # "user" or "assistant"
-    content = Column(Text, nullable=False)
-    tokens = Column(Integer, nullable=False)
 
+# How long a connection waits for a lock held elsewhere, in milliseconds
+_BUSY_TIMEOUT_MS = 5000
 
-# Create the SQLAlchemy engine and session factory once at import time
-settings = get_settings()
-engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
-# Create tables on first import
-Base.metadata.create_all(bind=engine)
+def _connect(path: str) -> sqlite3.Connection:
+    """Open a connection configured with the pragmas shared by all users.
 
+    ``isolation_level=None`` puts the driver in autocommit mode so each
+    statement is its own transaction.  ``busy_timeout`` makes a connection
+    that finds the database locked (for instance by another process) wait
+    for it instead of failing immediately.  Paths starting with ``file:``
+    are opened as URIs, so ``file:name?mode=memory&cache=shared`` gives an
+    in-memory database shared by all of a store's connections.
+    """
+    conn = sqlite3.connect(
+        path, check_same_thread=False, isolation_level=None, uri=path.startswith("file:")
+    )
+    conn.execute(f"PRAGMA busy_timeout={_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=memory")
+    conn.execute("PRAGMA cache_size=-64000")
+    return conn
 
-def add_message(session_id: str, role: str, content: str, tokens: int) -> None:
-    """Persist a new chat message to the database."""
-    db = SessionLocal()
-    try:
-        msg = Message(session_id=session_id, role=role, content=content, tokens=tokens)
-        db.add(msg)
-        db.commit()
-    finally:
-        db.close()
 
+# Statements are kept as module constants: sqlite3 caches each prepared
+# statement per connection keyed by its SQL text, so every call reuses the
+# compiled statement instead of parsing the SQL again.
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id VARCHAR NOT NULL,
+    role VARCHAR NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL
+)
+"""
+_INSERT = "INSERT INTO messages(session_id,role,content,tokens) VALUES(?,?,?,?)"
+_SELECT_MESSAGES = "SELECT role,content,tokens FROM messages WHERE session_id=? ORDER BY id"
+# The join happens inside SQLite so only one row crosses into Python
+_SELECT_CONTEXT = (
+    "SELECT group_concat(content, x'0a') FROM "
+    "(SELECT content FROM messages WHERE session_id=? ORDER BY id)"
+)
+_DELETE_SESSION = "DELETE FROM messages WHERE session_id=?"
 
-def get_messages(session_id: str) -> List[dict]:
-    """Retrieve all messages for a session ordered by insertion."""
-    db = SessionLocal()
-    try:
-        stmt = select(Message).where(Message.session_id == session_id).order_by(Message.id)
-        rows = db.execute(stmt).scalars().all()
+# Number of reader connections kept open for concurrent reads
+_READ_POOL_SIZE = 4
+# Number of session contexts kept in the in-process cache
+_CONTEXT_CACHE_SIZE = 1024
+
+
+class Store:
+    """Message store bound to a single SQLite database.
+
+    All connections are opened when the store is created: a single writer
+    (SQLite serialises writes anyway) and a pool of readers that WAL lets
+    run alongside it.  The table is created on first use of a database.
+    """
+
+    def __init__(self, db_url: str, read_pool_size: int = _READ_POOL_SIZE) -> None:
+        self._db_path = _sqlite_path(db_url)
+        self._write_conn = _connect(self._db_path)
+        self._write_conn.execute(_CREATE_TABLE)
+        # Serves the per-session lookups already ordered by id, so reads are a
+        # range scan with no sort step.
+        self._write_conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_session ON messages(session_id, id)"
+        )
+        # Databases created by the earlier SQLAlchemy schema also carry a
+        # single-column index on session_id that duplicates the one above;
+        # drop it so inserts do not maintain two copies.
+        self._write_conn.execute("DROP INDEX IF EXISTS ix_messages_session_id")
+        # Guards the writer connection; WAL lets reads proceed concurrently.
+        self._write_lock = threading.Lock()
+        self._read_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(read_pool_size):
+            self._read_pool.put(_connect(self._db_path))
+        # Most recently used session contexts.  ``None`` marks a session with
+        # no messages, as returned by ``group_concat`` over zero rows.
+        self._context_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Cold reads in flight, as ``[generation, readers]`` per session.
+        # Writes bump the generation when they start and again when they
+        # finish, so it is odd while a write is in progress; a read only
+        # fills the cache if the generation is even and unchanged since it
+        # began.  Entries are dropped once their last reader is done.
+        self._pending_reads: Dict[str, List[int]] = {}
+        # Session of the write in progress, if any (writes are serialised)
+        self._writing: Optional[str] = None
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader connection from the pool for the duration of a block."""
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
+    def _mark_write(self, session_id: str, writing: bool) -> None:
+        """Record that a write to ``session_id`` started or finished."""
+        with self._cache_lock:
+            self._writing = session_id if writing else None
+            pending = self._pending_reads.get(session_id)
+            if pending is not None:
+                pending[0] += 1
+
+    @contextmanager
+    def _write(self, session_id: str) -> Iterator[None]:
+        """Serialise a write to ``session_id`` against other writes.
+
+        Cold reads of the same session that overlap the write see its
+        generation change and leave the cache alone.
+        """
+        with self._write_lock:
+            self._mark_write(session_id, True)
+            try:
+                yield
+            finally:
+                self._mark_write(session_id, False)
+
+    def _extend_cached_context(self, session_id: str, contents: List[str]) -> None:
+        """Append freshly written message contents to a cached context.
+
+        Must be called inside :meth:`_write` so cache updates happen in the
+        same order as the writes.  Sessions that are not cached are
+        left alone; they will be loaded from the database on the next read.
+        """
+        with self._cache_lock:
+            if not contents or session_id not in self._context_cache:
+                return
+            added = "\n".join(contents)
+            previous = self._context_cache[session_id]
+            self._context_cache[session_id] = added if previous is None else previous + "\n" + added
+
+    def add_message(self, session_id: str, role: str, content: str, tokens: int) -> None:
+        """Persist a new chat message to the database."""
+        with self._write(session_id):
+            self._write_conn.execute(_INSERT, (session_id, role, content, tokens))
+            self._extend_cached_context(session_id, [content])
+
+    def add_messages(self, session_id: str, rows: Iterable[Tuple[str, str, int]]) -> None:
+        """Persist several chat messages for a session in one transaction.
+
+        ``rows`` holds ``(role, content, tokens)`` tuples which are inserted
+        in order.  Grouping them under a single ``BEGIN``/``COMMIT`` pays for
+        one commit instead of one per message.
+        """
+        params = [(session_id, role, content, tokens) for role, content, tokens in rows]
+        with self._write(session_id):
+            with self._write_conn:
+                self._write_conn.execute("BEGIN")
+                self._write_conn.executemany(_INSERT, params)
+            self._extend_cached_context(session_id, [content for _, _, content, _ in params])
+
+    def get_messages(self, session_id: str) -> List[dict]:
+        """Retrieve all messages for a session ordered by insertion."""
+        with self._reader() as conn:
+            rows = conn.execute(_SELECT_MESSAGES, (session_id,)).fetchall()
         return [
-            {"role": row.role, "content": row.content, "tokens": row.tokens}
-            for row in rows
+            {"role": role, "content": content, "tokens": tokens}
+            for role, content, tokens in rows
         ]
-    finally:
-        db.close()
+
+    def get_context(self, session_id: str) -> str:
+        """Concatenate message contents into a single context string.
+
+        Cached contexts are returned directly; otherwise the join happens
+        inside SQLite so only one row crosses into Python.
+        """
+        with self._cache_lock:
+            if session_id in self._context_cache:
+                self._context_cache.move_to_end(session_id)
+                return self._context_cache[session_id] or ""
+            # Register the read so overlapping writes can be detected without
+            # holding the write lock across the query.
+            pending = self._pending_reads.get(session_id)
+            if pending is None:
+                generation = 1 if self._writing == session_id else 0
+                pending = self._pending_reads[session_id] = [generation, 0]
+            pending[1] += 1
+            generation = pending[0]
+        row = None
+        try:
+            with self._reader() as conn:
+                row = conn.execute(_SELECT_CONTEXT, (session_id,)).fetchone()
+        finally:
+            with self._cache_lock:
+                pending[1] -= 1
+                if not pending[1]:
+                    del self._pending_reads[session_id]
+                # Cache only if no write to the session started or finished
+                # while the query ran
+                if row is not None and pending[0] == generation and not generation % 2:
+                    self._context_cache[session_id] = row[0]
+                    if len(self._context_cache) > _CONTEXT_CACHE_SIZE:
+                        self._context_cache.popitem(last=False)
+        return row[0] or ""
+
+    def clear_session(self, session_id: str) -> None:
+        """Remove all messages belonging to a session."""
+        with self._write(session_id):
+            self._write_conn.execute(_DELETE_SESSION, (session_id,))
+            with self._cache_lock:
+                self._context_cache.pop(session_id, None)
+
+    def close(self) -> None:
+        """Close every connection held by the store."""
+        with self._write_lock:
+            self._write_conn.close()
+            while not self._read_pool.empty():
+                self._read_pool.get_nowait().close()
+
+
+@lru_cache()
+def get_store() -> Store:
+    """Return the process-wide store for ``DATABASE_URL``.
+
+    The store is created on first use rather than at import time, so
+    importing this module does not touch the database.
+    """
+    return Store(get_settings().database_url)
+
+
+def add_message(session_id: str, role: str, content: str, tokens: int) -> None:
+    """Persist a new chat message to the default store."""
+    get_store().add_message(session_id, role, content, tokens)
+
+
+def add_messages(session_id: str, rows: Iterable[Tuple[str, str, int]]) -> None:
+    """Persist several chat messages to the default store in one transaction."""
+    get_store().add_messages(session_id, rows)
+
+
+def get_messages(session_id: str) -> List[dict]:
+    """Retrieve all messages for a session from the default store."""
+    return get_store().get_messages(session_id)
 
 
 def get_context(session_id: str) -> str:
-    """Concatenate message contents into a single context string."""
-    messages = get_messages(session_id)
-    return "\n".join(msg["content"] for msg in messages)
+    """Concatenate a session's messages from the default store."""
+    return get_store().get_context(session_id)
 
 
 def clear_session(session_id: str) -> None:
-    """Remove all messages belonging to a session."""
-    db = SessionLocal()
-    try:
-        stmt = delete(Message).where(Message.session_id == session_id)
-        db.execute(stmt)
-        db.commit()
-    finally:
-        db.close()
\ No newline at end of file
+    """Remove all messages belonging to a session from the default store."""
+    get_store().clear_session(session_id)
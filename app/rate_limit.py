@@ -1,7 +1,10 @@
 """Simple in-memory rate limiter.
 
-This module implements a sliding window rate limiter for both request count
-and token consumption.  Each identity (API key) maintains its own quota.
+This module implements a token bucket rate limiter for both request count
+and token consumption.  Each identity (API key) owns a bucket holding its
+remaining request and token allowance; buckets refill continuously at the
+configured per‑minute rate up to that same amount.  Checking a request
+costs a constant amount of work however much traffic an identity sends.
 The limiter uses an in-memory store and is suitable for a single-process
 deployment.  For horizontally scaled deployments, a shared cache such as
 Redis should be used instead of this module.
@@ -19,33 +22,53 @@ Usage::
         ...
 """
 
-from collections import deque
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from time import time
-from typing import Dict, Deque, Tuple
+from time import monotonic_ns
 from fastapi import HTTPException, status
 
 from .config import get_settings
 
+# Length of the window the limits are expressed over, in nanoseconds
+_WINDOW_NS = 60_000_000_000
+# Clock used for refills; tests replace it with a fake
+_now = monotonic_ns
+# Hard cap on the number of identities tracked at once
+_MAX_IDENTITIES = 100_000
+# Most idle buckets evicted by a single check
+_SWEEP_BATCH = 2
 
-@dataclass
-class Quota:
-    """Track timestamped request and token usage entries.
+
+@dataclass(slots=True)
+class Bucket:
+    """Remaining allowance of a single identity.
+
+    Allowances are kept as exact integers scaled by the window length: a
+    request (or token) costs ``_WINDOW_NS`` units, and every elapsed
+    nanosecond adds the per‑minute limit.  Refilling is then a single
+    integer multiply, with no division and no rounding drift.
 
     Attributes
     ----------
-    reqs: Deque[float]
-        Timestamps (seconds since epoch) of requests in the current window.
-    tokens: Deque[Tuple[float, int]]
-        Pairs of (timestamp, token count) recording token usage events.
+    requests: int
+        Request allowance left right now, in units of ``1 / _WINDOW_NS``
+        requests.
+    tokens: int
+        Token allowance left right now, in units of ``1 / _WINDOW_NS``
+        tokens.
+    last_ns: int
+        Monotonic timestamp (nanoseconds) at which the bucket was last
+        refilled.
     """
 
-    reqs: Deque[float]
-    tokens: Deque[Tuple[float, int]]
+    requests: int
+    tokens: int
+    last_ns: int
 
 
 class RateLimiter:
-    """Sliding‑window rate limiter for requests and tokens."""
+    """Token‑bucket rate limiter for requests and tokens."""
 
     def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
         self.requests_per_minute = requests_per_minute
@@ -53,13 +76,51 @@ class RateLimiter:
         settings = get_settings()
         # Prioritise tokens_per_minute from settings if set differently than default
         self.tokens_per_minute = tokens_per_minute or settings.tokens_per_minute or settings.rate_limit_tpm
-        # In-memory store of quotas per identity
-        self._store: Dict[str, Quota] = {}
-
-    def _get_quota(self, identity: str) -> Quota:
-        if identity not in self._store:
-            self._store[identity] = Quota(deque(), deque())
-        return self._store[identity]
+        # Bucket capacities in scaled units; a full bucket takes one window
+        # to refill
+        self._request_capacity = self.requests_per_minute * _WINDOW_NS
+        self._token_capacity = self.tokens_per_minute * _WINDOW_NS
+        # In-memory store of buckets per identity, ordered from least to most
+        # recently used.  A single lock makes each refill-check-consume
+        # sequence atomic; it is held only for a few arithmetic operations.
+        self._store: "OrderedDict[str, Bucket]" = OrderedDict()
+        self._max_identities = _MAX_IDENTITIES
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, identity: str, now: int) -> Bucket:
+        bucket = self._store.get(identity)
+        if bucket is None:
+            bucket = self._store[identity] = Bucket(self._request_capacity, self._token_capacity, now)
+            # Bound memory even when identities rotate faster than they expire
+            if len(self._store) > self._max_identities:
+                self._store.popitem(last=False)
+        else:
+            self._store.move_to_end(identity)
+        return bucket
+
+    def _sweep(self, now: int) -> None:
+        """Drop up to ``_SWEEP_BATCH`` buckets that have been idle for a window.
+
+        Such buckets have refilled to capacity and are indistinguishable from
+        a freshly created one, so evicting them only bounds memory.  The
+        store is ordered by last use, so only its head needs looking at.
+        Each check adds at most one bucket and may remove several, so idle
+        identities are reclaimed at a constant cost per call rather than in
+        an occasional full pass.
+        """
+        store = self._store
+        for _ in range(_SWEEP_BATCH):
+            if not store:
+                return
+            bucket = next(iter(store.values()))
+            if now - bucket.last_ns < _WINDOW_NS:
+                return
+            store.popitem(last=False)
+
+    @staticmethod
+    def _retry_after(deficit: int, per_minute: int) -> str:
+        """Whole seconds until ``deficit`` scaled units refill at ``per_minute``."""
+        return str(max(1, -(-deficit // (per_minute * 1_000_000_000))))
 
     def check(self, identity: str, tokens: int) -> None:
         """Check and update the rate limits for a given identity.
@@ -74,34 +135,45 @@ class RateLimiter:
         Raises
         ------
         HTTPException
-            If the request exceeds the configured request or token rate limit.
+            429 if the request exceeds the configured request or token rate
+            limit, or 413 if it needs more tokens than a full bucket holds,
+            which no amount of waiting would satisfy.
         """
-        now = time()
-        quota = self._get_quota(identity)
-        # Drop expired entries (older than 60 seconds)
-        window_start = now - 60
-        while quota.reqs and quota.reqs[0] <= window_start:
-            quota.reqs.popleft()
-        while quota.tokens and quota.tokens[0][0] <= window_start:
-            quota.tokens.popleft()
-        # Check request limit
-        if self.requests_per_minute > 0 and len(quota.reqs) >= self.requests_per_minute:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded: too many requests per minute",
-                headers={"Retry-After": "60"},
-            )
-        # Check token limit
-        total_tokens = sum(t for _, t in quota.tokens)
-        if self.tokens_per_minute > 0 and (total_tokens + tokens) > self.tokens_per_minute:
+        if 0 < self.tokens_per_minute < tokens:
+            # Plain 413: Starlette renamed the constant, and the new name is
+            # missing from older releases that requirements.txt allows
             raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded: too many tokens per minute",
-                headers={"Retry-After": "60"},
+                status_code=413,
+                detail="Request exceeds the per-minute token limit",
             )
-        # Record current request and tokens
-        quota.reqs.append(now)
-        quota.tokens.append((now, tokens))
+        now = _now()
+        with self._lock:
+            # Evict a few idle identities on every call
+            self._sweep(now)
+            bucket = self._get_bucket(identity, now)
+            # Refill for the time elapsed since the last check
+            elapsed = now - bucket.last_ns
+            bucket.last_ns = now
+            bucket.requests = min(self._request_capacity, bucket.requests + elapsed * self.requests_per_minute)
+            bucket.tokens = min(self._token_capacity, bucket.tokens + elapsed * self.tokens_per_minute)
+            # Check request limit
+            if self.requests_per_minute > 0 and bucket.requests < _WINDOW_NS:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded: too many requests per minute",
+                    headers={"Retry-After": self._retry_after(_WINDOW_NS - bucket.requests, self.requests_per_minute)},
+                )
+            # Check token limit
+            cost = tokens * _WINDOW_NS
+            if self.tokens_per_minute > 0 and bucket.tokens < cost:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Rate limit exceeded: too many tokens per minute",
+                    headers={"Retry-After": self._retry_after(cost - bucket.tokens, self.tokens_per_minute)},
+                )
+            # Consume allowance for the current request
+            bucket.requests -= _WINDOW_NS
+            bucket.tokens -= cost
 
 
 def get_rate_limiter() -> RateLimiter:
@@ -6,9 +6,13 @@ implements the algorithm described in the paper "Query‑Focused
 Retrieval Heads Improve Long‑Context Reasoning and Re‑ranking" by
 Zhang et al.  The core idea is to identify a small set of attention
 heads that naturally attend to the query‑relevant parts of the
-context.  At runtime we run the model once with `output_attentions`
-enabled, extract the attention scores of those heads and select the
-top‑K tokens.
+context.  At runtime we run the model once with hooks on the attention
+layers; for just those heads the hooks score every token against the
+first query token and we keep the top‑K tokens.  The model itself runs
+in bfloat16 with PyTorch's SDPA kernel, or FlashAttention 2 when the
+optional ``flash-attn`` package is installed on a CUDA machine.  Neither
+materialises the full attention matrix, so the few scores we need are
+recomputed from the layer's query and key projections instead.
 
 If no LoRA weights are provided or the weights do not specify
 retrieval heads metadata, a naive fallback summarisation is used
@@ -17,9 +21,10 @@ the context, ensuring that at least some history is retained.
 """
 from __future__ import annotations
 
+import importlib.util
 import logging
 from functools import lru_cache
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -29,6 +34,22 @@ from ..config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Delimiter placed between the query and the context.  Using a clear
+# delimiter helps the model distinguish between query and context segments.
+_SEP = "\n\n### CONTEXT ###\n\n"
+
+
+def _attn_implementation() -> str:
+    """Return the attention kernel to request when loading the model.
+
+    FlashAttention 2 is opt-in: it is only requested when ``flash-attn``
+    is installed and a CUDA device is present.  Otherwise PyTorch's SDPA
+    kernel is used.
+    """
+    if importlib.util.find_spec("flash_attn") is not None and torch.cuda.is_available():
+        return "flash_attention_2"
+    return "sdpa"
+
 
 @lru_cache(maxsize=1)
 def _load_model() -> Tuple[AutoModelForCausalLM, AutoTokenizer, List[Tuple[int, int]]]:
@@ -42,19 +63,25 @@ def _load_model() -> Tuple[AutoModelForCausalLM, AutoTokenizer, List[Tuple[int,
     model_name = settings.model_name
     lora_id = settings.lora_id
     logger.info(f"Loading base model {model_name}")
-    # Use 8bit quantisation if bitsandbytes is available; otherwise use
-    # half precision to reduce memory usage.
+    attn_implementation = _attn_implementation()
     try:
         model = AutoModelForCausalLM.from_pretrained(
             model_name,
-            load_in_8bit=True,
+            torch_dtype=torch.bfloat16,
+            attn_implementation=attn_implementation,
             device_map="auto",
         )
-    except Exception:
-        # Fallback to fp16
+    except (ImportError, ValueError) as exc:
+        # transformers raises these when FlashAttention 2 cannot be used
+        # with this model or GPU.  Anything else (out of memory, download
+        # or authentication failures) is a real error and propagates.
+        if attn_implementation == "sdpa":
+            raise
+        logger.warning(f"FlashAttention 2 unavailable ({exc}); falling back to SDPA")
         model = AutoModelForCausalLM.from_pretrained(
             model_name,
-            torch_dtype=torch.float16,
+            torch_dtype=torch.bfloat16,
+            attn_implementation="sdpa",
             device_map="auto",
         )
     tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -76,6 +103,61 @@ def _load_model() -> Tuple[AutoModelForCausalLM, AutoTokenizer, List[Tuple[int,
     return model, tokenizer, retrieval_heads
 
 
+@lru_cache(maxsize=1)
+def _separator_ids() -> Tuple[List[int], int, int]:
+    """Tokenise the separator once.
+
+    Returns a tuple of (separator_ids, num_prefix, num_suffix): the
+    number of special tokens the tokenizer adds in front of an encoded
+    text (e.g. BOS) and after it (e.g. EOS).  Together with the query
+    length these locate the context inside the encoded input.
+    """
+    _, tokenizer, _ = _load_model()
+    sep_ids = tokenizer(_SEP, add_special_tokens=False).input_ids
+    # Find the plain encoding inside the one with special tokens to tell
+    # leading special tokens from trailing ones.
+    full_ids = tokenizer(_SEP).input_ids
+    num_added = len(full_ids) - len(sep_ids)
+    num_prefix = next(
+        (i for i in range(num_added + 1) if full_ids[i:i + len(sep_ids)] == sep_ids),
+        num_added,
+    )
+    return sep_ids, num_prefix, num_added - num_prefix
+
+
+def warm_up() -> None:
+    """Load the model and tokenise the separator ahead of the first request.
+
+    Both are cached, so calling this at startup moves the model load out
+    of the first call to :func:`reduce`.
+    """
+    _load_model()
+    _separator_ids()
+
+
+def _rotate_half(x: torch.Tensor) -> torch.Tensor:
+    """Rotate half the hidden dims of ``x``, as used by rotary embeddings."""
+    x1, x2 = x.chunk(2, dim=-1)
+    return torch.cat((-x2, x1), dim=-1)
+
+
+def _apply_rotary(x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor) -> torch.Tensor:
+    """Apply rotary position embeddings to ``x`` of shape (batch, heads, seq, dim)."""
+    cos = cos.unsqueeze(1)
+    sin = sin.unsqueeze(1)
+    return x * cos + _rotate_half(x) * sin
+
+
+class _StopForward(Exception):
+    """Raised by the last scoring hook to skip the rest of the forward pass."""
+
+
+def _decoder_layers(model) -> torch.nn.ModuleList:
+    """Return the decoder layers of ``model``, unwrapping a PEFT model."""
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    return base.model.layers
+
+
 def reduce(query: str, context: str, top_k: int | None = None) -> Tuple[str, int, int]:
     """Reduce a long context to its most relevant parts.
 
@@ -84,75 +166,117 @@ def reduce(query: str, context: str, top_k: int | None = None) -> Tuple[str, int
     :param top_k: Number of tokens to keep; if None uses settings.top_k.
     :returns: tuple of (condensed_text, tokens_before, tokens_after)
     """
-    settings = get_settings()
     if top_k is None:
-        top_k = settings.top_k
+        top_k = get_settings().top_k
     model, tokenizer, retrieval_heads = _load_model()
     device = next(model.parameters()).device
-    # Compose input with a separator token.  Using a clear delimiter helps
-    # the model distinguish between query and context segments.
-    sep = "\n\n### CONTEXT ###\n\n"
-    full_text = query + sep + context
+    # Compose input with a separator token
+    full_text = query + _SEP + context
     enc = tokenizer(full_text, return_tensors="pt", truncation=False)
-    input_ids = enc.input_ids.to(device)
-    tokens_before = input_ids.shape[1]
+    tokens_before = enc.input_ids.shape[1]
+    # Locate the context: it follows the leading special tokens, the query
+    # and the separator, and precedes any trailing special tokens.  The
+    # query is tokenised exactly once.
+    sep_ids, num_prefix, num_suffix = _separator_ids()
+    query_len = len(tokenizer(query, add_special_tokens=False).input_ids)
+    context_start = num_prefix + query_len + len(sep_ids)
+    context_end = tokens_before - num_suffix
+    # A context that already fits the budget is returned untouched, without
+    # running the model.
+    context_len = context_end - context_start
+    if context_len <= top_k:
+        return context, tokens_before, context_len
     # If no retrieval heads available, fall back to naive summarisation
     if not retrieval_heads:
         # Keep the first K/2 and last K/2 tokens of the context
         half = max(top_k // 2, 1)
         # Extract only the context part of the ids (after sep)
-        # We'll locate the sep by tokenising separately for robustness.
-        sep_ids = tokenizer(sep, return_tensors="pt").input_ids.squeeze().tolist()
-        sep_len = len(sep_ids)
-        # Remove the query tokens and separator from the input
-        query_tokens = tokenizer(query, return_tensors="pt").input_ids.squeeze().tolist()
-        start_idx = len(query_tokens) + sep_len
-        context_ids = input_ids.squeeze().tolist()[start_idx:]
-        if len(context_ids) <= top_k:
-            selected = context_ids
-        else:
-            selected = context_ids[:half] + context_ids[-half:]
+        context_ids = enc.input_ids[0].tolist()[context_start:context_end]
+        selected = context_ids[:half] + context_ids[-half:]
         condensed = tokenizer.decode(selected, skip_special_tokens=True)
         tokens_after = len(selected)
         return condensed, tokens_before, tokens_after
-    # Run the model once to get attention scores.  We disable caching
-    # because we need full attentions across the entire context.
-    with torch.no_grad():
-        outputs = model(
-            input_ids=input_ids,
-            attention_mask=enc.attention_mask.to(device),
-            output_attentions=True,
-            use_cache=False,
-        )
-    # outputs.attentions is a tuple of length num_layers; each element is
-    # (batch, num_heads, seq_len, seq_len)
-    attentions = outputs.attentions
-    # Compute per-token relevance by averaging the attention scores of
-    # the selected heads onto the query token (position 0).  We collect
-    # relevance across all selected heads and normalise.
+    input_ids = enc.input_ids.to(device)
+    # Compute per-token relevance by summing the attention scores of the
+    # selected heads from the query token (position 0) onto every token.
+    # The attention kernel does not return its weights, so a pre-hook on
+    # each relevant attention module recomputes softmax(q0·Kᵀ/√d) from the
+    # layer's own projections and rotary embeddings: one matrix-vector
+    # product per head instead of a (seq_len, seq_len) matrix, batched over
+    # the heads of each layer.
     seq_len = input_ids.shape[1]
     relevance = torch.zeros(seq_len, device=device)
+    layers = _decoder_layers(model)
+    heads_by_layer: Dict[int, List[int]] = {}
     for layer_idx, head_idx in retrieval_heads:
-        # Clamp layer index because LoRA might refer to last layers
-        layer = attentions[layer_idx]
-        # Attention from query token (position 0) to all tokens
-        # shape: (batch, num_heads, tgt_len, src_len)
-        attn_scores = layer[0, head_idx, 0, :]
-        relevance += attn_scores
+        if not -len(layers) <= layer_idx < len(layers):
+            raise IndexError(
+                f"Retrieval head layer {layer_idx} out of range for {len(layers)} layers"
+            )
+        # Normalise negative indices (e.g. -1 for the last layer)
+        heads_by_layer.setdefault(layer_idx % len(layers), []).append(head_idx)
+
+    # Nothing past the deepest retrieval layer contributes to the scores, so
+    # its hook aborts the forward pass once it has scored its heads; the
+    # remaining layers and the LM head never run.
+    last_layer = max(heads_by_layer)
+
+    def make_hook(heads: List[int], stop: bool):
+        def hook(module, args, kwargs):
+            hidden = kwargs["hidden_states"] if "hidden_states" in kwargs else args[0]
+            cos, sin = kwargs["position_embeddings"]
+            head_dim = module.head_dim
+            # Query of position 0 only, keys of every position:
+            # (batch, heads, seq, head_dim)
+            query_states = module.q_proj(hidden[:, :1]).view(1, 1, -1, head_dim).transpose(1, 2)
+            key_states = module.k_proj(hidden).view(1, seq_len, -1, head_dim).transpose(1, 2)
+            query_states = _apply_rotary(query_states, cos[:, :1], sin[:, :1])
+            key_states = _apply_rotary(key_states, cos, sin)
+            # Score all of this layer's heads with one batched product.
+            # Grouped-query attention shares each key head across groups.
+            head_idx = torch.tensor(heads, device=hidden.device)
+            kv_idx = head_idx // module.num_key_value_groups
+            scores = key_states[0, kv_idx] @ query_states[0, head_idx, 0].unsqueeze(-1)
+            probs = (scores.squeeze(-1).float() * head_dim**-0.5).softmax(-1)
+            relevance.add_(probs.sum(0).to(device))
+            if stop:
+                raise _StopForward
+        return hook
+
+    handles = [
+        layers[layer_idx].self_attn.register_forward_pre_hook(
+            make_hook(heads, layer_idx == last_layer), with_kwargs=True
+        )
+        for layer_idx, heads in heads_by_layer.items()
+    ]
+    # Run the model once; the hooks fill in ``relevance`` as it goes.
+    # ``inference_mode`` also skips autograd's version counters and view
+    # tracking, which ``no_grad`` still pays for.
+    try:
+        with torch.inference_mode():
+            model(
+                input_ids=input_ids,
+                attention_mask=enc.attention_mask.to(device),
+                use_cache=False,
+            )
+    except _StopForward:
+        pass
+    finally:
+        for handle in handles:
+            handle.remove()
     # Normalise
     relevance /= max(len(retrieval_heads), 1)
     # Pick the top_k highest scoring tokens *after the query and separator*
-    # We avoid selecting query tokens by zeroing their relevance.
-    sep_ids = tokenizer(sep, return_tensors="pt").input_ids.squeeze().tolist()
-    sep_len = len(sep_ids)
-    query_len = len(tokenizer(query, return_tensors="pt").input_ids.squeeze().tolist())
-    # Zero out relevance for query tokens and separator
-    relevance[: query_len + sep_len] = -float("inf")
-    # Identify top_k indices
-    top_scores, top_indices = torch.topk(relevance, k=min(top_k, seq_len))
-    # Sort indices to preserve order in input
-    sorted_indices = torch.sort(top_indices).values.tolist()
-    selected_ids = input_ids.squeeze()[sorted_indices].tolist()
+    # We avoid selecting query and trailing special tokens by zeroing their
+    # relevance.
+    relevance[:context_start] = -float("inf")
+    relevance[context_end:] = -float("inf")
+    # Identify top_k indices.  Their order does not matter to topk; the K
+    # positions are sorted on the host to preserve order in input, and the
+    # ids are gathered from the host copy of the encoding.
+    _, top_indices = torch.topk(relevance, k=min(top_k, seq_len), sorted=False)
+    sorted_indices = sorted(top_indices.tolist())
+    selected_ids = enc.input_ids[0, sorted_indices].tolist()
     condensed = tokenizer.decode(selected_ids, skip_special_tokens=True)
     tokens_after = len(selected_ids)
     return condensed, tokens_before, tokens_after
\ No newline at end of file
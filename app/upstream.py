@@ -5,16 +5,36 @@ requests to the configured upstream provider (e.g. OpenAI, Anthropic).
 It respects the ``UPSTREAM_BASE`` and ``UPSTREAM_API_KEY`` environment
 variables set via :class:`app.config.Settings`.
 
-Calls are made asynchronously using httpx.  In the case of streaming
-responses, the caller is expected to handle SSE format on its own; this
-module simply yields JSON event payloads as they arrive.
+Calls are made asynchronously using a single shared httpx client, so
+connections to the upstream (including TLS sessions) are pooled and
+reused across requests instead of being re-established per call.  The
+client is created on first use by :func:`_get_client` and closed by
+:func:`close_client` when the application shuts down.  In the case of streaming
+responses, the upstream body is relayed byte for byte as it arrives, so
+the Server Sent Events framing is preserved without decoding events.
 """
 
-import json
+from functools import lru_cache
 from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 import httpx
 
-from .config import get_settings
+from .config import Settings, get_settings
+
+@lru_cache(maxsize=1)
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared upstream HTTP client, creating it on first use."""
+    return httpx.AsyncClient(
+        timeout=60,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        http2=True,
+    )
+
+
+async def close_client() -> None:
+    """Close the shared upstream HTTP client and release its connections."""
+    if _get_client.cache_info().currsize:
+        await _get_client().aclose()
+        _get_client.cache_clear()
 
 
 async def call_llm(
@@ -23,7 +43,9 @@ async def call_llm(
     stream: bool = False,
     authorization: Optional[str] = None,
     extra: Optional[Dict[str, Any]] = None,
-) -> Union[Dict[str, Any], AsyncGenerator[Dict[str, Any], None]]:
+    *,
+    settings: Optional[Settings] = None,
+) -> Union[bytes, AsyncGenerator[bytes, None]]:
     """Forward a chat completion request to the upstream provider.
 
     Parameters
@@ -36,22 +58,27 @@ async def call_llm(
     stream: bool
         Whether to stream the response as Server Sent Events.  If
         ``True``, this function returns an async generator that yields
-        decoded JSON events; otherwise it returns the full JSON response.
+        the raw SSE body in chunks; otherwise it returns the raw JSON body.
     authorization: Optional[str]
         The caller's ``Authorization`` header.  If provided, this is
         forwarded directly to the upstream.  Otherwise, the value of
         ``UPSTREAM_API_KEY`` is used.
     extra: Optional[dict]
         Additional payload fields to include in the request body.
+    settings: Optional[Settings]
+        Settings already loaded for the current request; when omitted,
+        :func:`app.config.get_settings` is consulted.
 
     Returns
     -------
-    dict or async generator
-        Either the parsed JSON response (non‑streaming) or an async
-        generator yielding JSON events (streaming).
+    bytes or async generator
+        Either the undecoded JSON response body (non‑streaming), which the
+        caller can forward without re-serialising, or an async generator
+        yielding SSE bytes (streaming).
     """
-    settings = get_settings()
-    url = settings.upstream_base.rstrip("/") + "/v1/chat/completions"
+    if settings is None:
+        settings = get_settings()
+    url = settings.upstream_url
     headers: Dict[str, str] = {}
     # Choose API key: prefer caller's Authorization header, else env variable
     api_key = authorization or settings.upstream_api_key
@@ -65,20 +92,31 @@ async def call_llm(
     }
     if extra:
         payload.update(extra)
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        # Streaming responses return text/event-stream; parse incrementally
-        if stream:
-            async def event_generator() -> AsyncGenerator[Dict[str, Any], None]:
-                async for line in resp.aiter_lines():
-                    # Skip empty lines and the final '[DONE]'
-                    if not line or line.strip() == "data: [DONE]":
-                        continue
-                    if line.startswith("data:"):
-                        data = line[len("data:"):].strip()
-                        yield json.loads(data)
-                return
-            return event_generator()
-        else:
-            return resp.json()
\ No newline at end of file
+    client = _get_client()
+    # Streaming responses return text/event-stream; relay them as they
+    # arrive instead of buffering the whole body
+    if stream:
+        request = client.build_request("POST", url, headers=headers, json=payload)
+        resp = await client.send(request, stream=True)
+        try:
+            resp.raise_for_status()
+        except httpx.HTTPStatusError:
+            await resp.aclose()
+            raise
+        return _relay(resp)
+    resp = await client.post(url, headers=headers, json=payload)
+    resp.raise_for_status()
+    return resp.content
+
+
+async def _relay(resp: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """Yield a streamed response body and close the response when done.
+
+    ``aiter_bytes`` (rather than ``aiter_raw``) undoes any content encoding
+    the upstream applied, since the body is re-sent without its headers.
+    """
+    try:
+        async for chunk in resp.aiter_bytes():
+            yield chunk
+    finally:
+        await resp.aclose()
@@ -1,5 +1,51 @@
 import sys
 from pathlib import Path
 
+import httpx
+import pytest
+
 # Ensure project root is on sys.path for imports
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import config, upstream  # noqa: E402
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Fresh settings for one test, returned by every ``get_settings``.
+
+    Modules import ``get_settings`` by name, so the patch is applied to each
+    loaded ``app`` module that holds a reference.  Tests adjust the returned
+    object directly instead of setting environment variables and clearing
+    the settings cache.
+    """
+    s = config.Settings()
+    for name, module in list(sys.modules.items()):
+        if (name == "app" or name.startswith("app.")) and hasattr(module, "get_settings"):
+            monkeypatch.setattr(module, "get_settings", lambda: s)
+    return s
+
+
+class MockUpstream:
+    """In-process stand-in for the upstream provider.
+
+    Every request is recorded in ``requests`` and answered with
+    ``response``, which tests may replace before making a call.
+    """
+
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+        self.response = httpx.Response(200, json={"ok": True})
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return self.response
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    """Send upstream calls through a real client backed by a mock transport."""
+    mock = MockUpstream()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(mock.handler))
+    monkeypatch.setattr(upstream, "_get_client", lambda: client)
+    return mock
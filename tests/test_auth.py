@@ -1,37 +1,50 @@
 import pytest
-from fastapi import HTTPException
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
 
 from app import auth, config
 
 
-@pytest.mark.asyncio
-async def test_returns_empty_when_no_keys(monkeypatch):
-    monkeypatch.setenv("API_KEYS", "")
-    config.get_settings.cache_clear()
-    identity = await auth.get_current_identity()
+async def test_returns_empty_when_no_keys():
+    settings = config.Settings(api_keys="")
+    identity = await auth.get_current_identity(None, settings)
     assert identity == ""
 
 
-@pytest.mark.asyncio
-async def test_accepts_valid_key(monkeypatch):
-    monkeypatch.setenv("API_KEYS", "key1,key2")
-    config.get_settings.cache_clear()
-    identity = await auth.get_current_identity("key2")
+async def test_accepts_valid_key():
+    settings = config.Settings(api_keys="key1,key2")
+    identity = await auth.get_current_identity("key2", settings)
     assert identity == "key2"
 
 
-@pytest.mark.asyncio
-async def test_missing_key_raises(monkeypatch):
-    monkeypatch.setenv("API_KEYS", "abc")
-    config.get_settings.cache_clear()
+async def test_missing_key_raises():
+    settings = config.Settings(api_keys="abc")
     with pytest.raises(HTTPException) as exc:
-        await auth.get_current_identity(None)
+        await auth.get_current_identity(None, settings)
     assert exc.value.status_code == 401
 
 
-@pytest.mark.asyncio
-async def test_invalid_key_raises(monkeypatch):
-    monkeypatch.setenv("API_KEYS", "valid")
-    config.get_settings.cache_clear()
+async def test_invalid_key_raises():
+    settings = config.Settings(api_keys="valid")
     with pytest.raises(HTTPException):
-        await auth.get_current_identity("invalid")
+        await auth.get_current_identity("invalid", settings)
+
+
+def test_api_keys_parsed_into_frozenset(monkeypatch):
+    monkeypatch.setenv("API_KEYS", " key1 , ,key2")
+    assert config.Settings().api_keys == frozenset({"key1", "key2"})
+
+
+def test_settings_dependency_can_be_overridden():
+    app = FastAPI()
+
+    @app.get("/whoami")
+    async def whoami(identity: str = Depends(auth.get_current_identity)):
+        return {"identity": identity}
+
+    settings = config.Settings(api_keys="key1")
+    app.dependency_overrides[config.get_settings] = lambda: settings
+    client = TestClient(app)
+
+    assert client.get("/whoami", headers={"X-API-Key": "key1"}).json() == {"identity": "key1"}
+    assert client.get("/whoami", headers={"X-API-Key": "dev-key"}).status_code == 401
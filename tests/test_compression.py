@@ -2,15 +2,36 @@
 from app import compression, config
 
 
-def test_compress_delegates_and_uses_settings(monkeypatch):
-    monkeypatch.setenv("TOP_K", "10")
-    config.get_settings.cache_clear()
+def test_compress_delegates_and_uses_settings(monkeypatch, settings):
+    settings.top_k = 10
 
-    def fake_reduce(query, context):
-        assert config.get_settings().top_k == 10
+    def fake_reduce(query, context, top_k=None):
+        assert top_k == 10
         return "condensed text", 200, 50
 
     monkeypatch.setattr(compression.qr_retriever, "reduce", fake_reduce)
 
     result = compression.compress("question", "context")
     assert result == ("condensed text", 200, 50)
+
+
+def test_compress_uses_passed_settings(monkeypatch):
+    settings = config.Settings(top_k=5)
+
+    def fake_reduce(query, context, top_k=None):
+        assert top_k == 5
+        return "condensed text", 200, 5
+
+    monkeypatch.setattr(compression.qr_retriever, "reduce", fake_reduce)
+
+    assert compression.compress("question", "context", settings=settings) == ("condensed text", 200, 5)
+
+
+def test_compress_counts_query_tokens_for_empty_context(monkeypatch):
+    def fake_reduce(query, context, top_k=None):
+        return context, 12, 0
+
+    monkeypatch.setattr(compression.qr_retriever, "reduce", fake_reduce)
+
+    # The query is still counted so that new sessions pay for their tokens
+    assert compression.compress("question", "") == ("", 12, 0)
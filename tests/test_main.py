@@ -0,0 +1,101 @@
+import uuid
+
+import httpx
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app import compression, config, main, memory, rate_limit
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Client for the app with auth disabled, a fresh store and a stub compressor."""
+    store = memory.Store(db_url=f"sqlite:///file:{uuid.uuid4().hex}?mode=memory&cache=shared")
+    monkeypatch.setattr(memory, "get_store", lambda: store)
+    monkeypatch.setattr(main, "compress", lambda query, context, settings=None: ("condensed", 10, 4))
+    settings = config.Settings(api_keys="", upstream_base="https://override.test")
+    main.app.dependency_overrides[config.get_settings] = lambda: settings
+    # Not used as a context manager, so the lifespan (model warm-up) never runs
+    yield TestClient(main.app), store
+    main.app.dependency_overrides.clear()
+
+
+def test_chat_completions_passes_upstream_body_through(client, mock_upstream):
+    test_client, store = client
+    # Unusual spacing shows the body is relayed, not re-serialised
+    body = b'{"id":"x",  "choices": [{"message": {"role": "assistant", "content": "hi there"}}]}'
+    mock_upstream.response = httpx.Response(
+        200, content=body, headers={"Content-Type": "application/json"}
+    )
+
+    resp = test_client.post(
+        "/v1/chat/completions",
+        json={"messages": [{"role": "user", "content": "hello"}]},
+        headers={"X-Session-ID": "sess"},
+    )
+
+    assert resp.status_code == 200
+    assert resp.content == body
+    assert resp.headers["x-tokens-before"] == "10"
+    assert resp.headers["x-tokens-after"] == "4"
+    assert resp.headers["x-tokens-saved"] == "6"
+    assert store.get_messages("sess") == [
+        {"role": "user", "content": "hello", "tokens": 4},
+        {"role": "assistant", "content": "hi there", "tokens": 2},
+    ]
+    # The overridden settings also choose the upstream endpoint
+    assert str(mock_upstream.requests[0].url) == "https://override.test/v1/chat/completions"
+    sent = orjson.loads(mock_upstream.requests[0].content)
+    assert sent["messages"][0] == {"role": "system", "content": "condensed"}
+
+
+def test_chat_completions_relays_stream(client, mock_upstream):
+    test_client, store = client
+    body = [b'data: {"delta": "hi"}\n\n', b"data: [DONE]\n\n"]
+
+    async def stream():
+        for chunk in body:
+            yield chunk
+
+    mock_upstream.response = httpx.Response(200, content=stream())
+
+    with test_client.stream(
+        "POST",
+        "/v1/chat/completions",
+        json={"messages": [{"role": "user", "content": "hello"}], "stream": True},
+        headers={"X-Session-ID": "sess"},
+    ) as resp:
+        chunks = list(resp.iter_raw())
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert resp.headers["x-tokens-saved"] == "6"
+    # The test client may merge chunks; chunk boundaries are covered by
+    # test_upstream, here the relayed bytes must be identical
+    assert b"".join(chunks) == b"".join(body)
+    # Only the user's message is stored for a streamed reply
+    assert store.get_messages("sess") == [{"role": "user", "content": "hello", "tokens": 4}]
+
+
+def test_empty_context_request_uses_token_allowance(client, monkeypatch, mock_upstream):
+    test_client, _ = client
+    # Real compress with a reducer that only counts the query
+    monkeypatch.setattr(main, "compress", compression.compress)
+    monkeypatch.setattr(
+        compression.qr_retriever, "reduce", lambda query, context, top_k=None: (context, 30, 0)
+    )
+    monkeypatch.setattr(main, "limiter", rate_limit.RateLimiter(requests_per_minute=60, tokens_per_minute=50))
+
+    def send():
+        # A fresh session each time, so the stored context is always empty
+        return test_client.post(
+            "/v1/chat/completions",
+            json={"messages": [{"role": "user", "content": "hello"}]},
+            headers={"X-Session-ID": uuid.uuid4().hex},
+        )
+
+    first = send()
+    assert first.status_code == 200
+    assert first.headers["x-tokens-before"] == "30"
+    assert send().status_code == 429
@@ -1,35 +1,122 @@
-import importlib
+import threading
+import uuid
+from contextlib import contextmanager
 
-from app import config
+import pytest
 
+from app import memory
 
-def setup_memory(monkeypatch, tmp_path):
-    db_path = tmp_path / "test.db"
-    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
-    config.get_settings.cache_clear()
-    from app import memory
-    importlib.reload(memory)
-    return memory
 
+def setup_memory():
+    # A uniquely named shared-cache database lives in memory for as long as
+    # the store keeps a connection to it, so tests never touch the disk.
+    name = uuid.uuid4().hex
+    return memory.Store(db_url=f"sqlite:///file:{name}?mode=memory&cache=shared")
 
-def test_add_and_get_messages(monkeypatch, tmp_path):
-    memory = setup_memory(monkeypatch, tmp_path)
-    memory.add_message("s", "user", "hello", 1)
-    memory.add_message("s", "assistant", "hi", 2)
-    msgs = memory.get_messages("s")
+
+def test_add_and_get_messages():
+    store = setup_memory()
+    store.add_message("s", "user", "hello", 1)
+    store.add_message("s", "assistant", "hi", 2)
+    msgs = store.get_messages("s")
     assert [m["content"] for m in msgs] == ["hello", "hi"]
 
 
-def test_get_context(monkeypatch, tmp_path):
-    memory = setup_memory(monkeypatch, tmp_path)
-    memory.add_message("sess", "user", "first", 1)
-    memory.add_message("sess", "assistant", "second", 2)
-    context = memory.get_context("sess")
+def test_in_memory_url_is_shared_by_all_connections():
+    store = memory.Store(db_url="sqlite:///:memory:")
+    store.add_message("s", "user", "hello", 1)
+    assert [m["content"] for m in store.get_messages("s")] == ["hello"]
+
+
+def test_sqlite_path_parses_urls():
+    assert memory._sqlite_path("sqlite:///./memory.db") == "./memory.db"
+    assert memory._sqlite_path("sqlite+pysqlite:////tmp/memory.db") == "/tmp/memory.db"
+    assert memory._sqlite_path("sqlite://").startswith("file:memdb-")
+    for url in ("./memory.db", "postgresql:///db", "sqlite://host/db"):
+        with pytest.raises(ValueError):
+            memory._sqlite_path(url)
+
+
+def test_add_messages_batch():
+    store = setup_memory()
+    store.add_messages("s", [("user", "hello", 1), ("assistant", "hi", 2)])
+    msgs = store.get_messages("s")
+    assert [(m["role"], m["content"]) for m in msgs] == [("user", "hello"), ("assistant", "hi")]
+
+
+def test_get_context():
+    store = setup_memory()
+    store.add_messages("sess", [("user", "first", 1), ("assistant", "second", 2)])
+    context = store.get_context("sess")
     assert context == "first\nsecond"
 
 
-def test_clear_session(monkeypatch, tmp_path):
-    memory = setup_memory(monkeypatch, tmp_path)
-    memory.add_message("id", "user", "msg", 1)
-    memory.clear_session("id")
-    assert memory.get_messages("id") == []
+def test_clear_session():
+    store = setup_memory()
+    store.add_message("id", "user", "msg", 1)
+    store.clear_session("id")
+    assert store.get_messages("id") == []
+
+
+def test_get_context_tracks_writes():
+    store = setup_memory()
+    assert store.get_context("sess") == ""
+    store.add_message("sess", "user", "first", 1)
+    assert store.get_context("sess") == "first"
+    store.add_messages("sess", [("assistant", "second", 2), ("user", "third", 1)])
+    assert store.get_context("sess") == "first\nsecond\nthird"
+    store.clear_session("sess")
+    assert store.get_context("sess") == ""
+
+
+def test_module_functions_use_default_store(monkeypatch):
+    store = setup_memory()
+    monkeypatch.setattr(memory, "get_store", lambda: store)
+    memory.add_messages("s", [("user", "hello", 1)])
+    assert memory.get_context("s") == "hello"
+    assert store.get_messages("s")[0]["content"] == "hello"
+
+
+def test_connections_use_wal_and_busy_timeout(tmp_path):
+    conn = memory._connect(str(tmp_path / "test.db"))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == memory._BUSY_TIMEOUT_MS
+
+
+def test_session_reads_use_index_without_sort():
+    store = setup_memory()
+    with store._reader() as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + memory._SELECT_MESSAGES, ("s",)).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_session" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_cold_context_read_does_not_wait_for_writes():
+    store = setup_memory()
+    store.add_message("sess", "user", "first", 1)
+    result = []
+    with store._write_lock:
+        reader = threading.Thread(target=lambda: result.append(store.get_context("sess")))
+        reader.start()
+        reader.join(timeout=5)
+    assert result == ["first"]
+
+
+def test_context_read_overlapping_a_write_is_not_cached(monkeypatch):
+    store = setup_memory()
+    store.add_message("sess", "user", "first", 1)
+    reader = store._reader
+
+    @contextmanager
+    def reader_then_write():
+        with reader() as conn:
+            yield conn
+        # Lands after the query but before the result is cached
+        store.add_message("sess", "assistant", "second", 2)
+
+    monkeypatch.setattr(store, "_reader", reader_then_write)
+    assert store.get_context("sess") == "first"
+    monkeypatch.setattr(store, "_reader", reader)
+    assert store.get_context("sess") == "first\nsecond"
+    assert store._pending_reads == {}
@@ -0,0 +1,216 @@
+import pytest
+import torch
+from transformers import MistralConfig, MistralForCausalLM
+from transformers.models.mistral.modeling_mistral import apply_rotary_pos_emb
+
+from app.services import qr_retriever
+
+
+class StubEncoding:
+    def __init__(self, ids, return_tensors=None):
+        if return_tensors == "pt":
+            self.input_ids = torch.tensor([ids])
+            self.attention_mask = torch.ones(1, len(ids), dtype=torch.long)
+        else:
+            self.input_ids = ids
+            self.attention_mask = [1] * len(ids)
+
+
+class StubTokenizer:
+    """Character-level tokenizer that prepends a BOS token (id 1).
+
+    With ``eos=True`` it also appends an EOS token (id 2).
+    """
+
+    def __init__(self, eos=False):
+        self.eos = eos
+
+    def __call__(self, text, return_tensors=None, truncation=False, add_special_tokens=True):
+        ids = [3 + ord(c) % 250 for c in text]
+        if add_special_tokens:
+            ids = [1] + ids + ([2] if self.eos else [])
+        return StubEncoding(ids, return_tensors)
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i - 3) for i in ids if i >= 3)
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2 if self.eos else 1
+
+
+@pytest.fixture
+def fake_loader(monkeypatch, settings):
+    """Record ``from_pretrained`` calls made by ``_load_model``.
+
+    ``errors`` maps an attention implementation to the exception raised
+    when it is requested.
+    """
+    calls, errors = [], {}
+
+    def from_pretrained(name, attn_implementation=None, **kwargs):
+        calls.append(attn_implementation)
+        if attn_implementation in errors:
+            raise errors[attn_implementation]
+        return object()
+
+    monkeypatch.setattr(qr_retriever, "_attn_implementation", lambda: "flash_attention_2")
+    monkeypatch.setattr(qr_retriever.AutoModelForCausalLM, "from_pretrained", from_pretrained)
+    monkeypatch.setattr(qr_retriever.AutoTokenizer, "from_pretrained", lambda name: StubTokenizer())
+    qr_retriever._load_model.cache_clear()
+    yield calls, errors
+    qr_retriever._load_model.cache_clear()
+
+
+def test_load_model_falls_back_to_sdpa_with_a_warning(fake_loader, caplog):
+    calls, errors = fake_loader
+    errors["flash_attention_2"] = ImportError("flash_attn missing")
+
+    qr_retriever._load_model()
+
+    assert calls == ["flash_attention_2", "sdpa"]
+    assert "flash_attn missing" in caplog.text
+
+
+def test_load_model_does_not_swallow_other_errors(fake_loader):
+    calls, errors = fake_loader
+    errors["flash_attention_2"] = OSError("gated repository")
+
+    with pytest.raises(OSError):
+        qr_retriever._load_model()
+    assert calls == ["flash_attention_2"]
+
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    """Install a random 4-layer Mistral with grouped-query attention."""
+    torch.manual_seed(0)
+    config = MistralConfig(
+        vocab_size=260,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+    )
+    model = MistralForCausalLM(config).eval()
+
+    def install(heads, tokenizer=None):
+        tokenizer = tokenizer or StubTokenizer()
+        monkeypatch.setattr(qr_retriever, "_load_model", lambda: (model, tokenizer, heads))
+        qr_retriever._separator_ids.cache_clear()
+        return model
+
+    yield install
+    qr_retriever._separator_ids.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "heads",
+    [
+        [(1, 0), (-1, 1)],
+        # Heads sharing a key head, and no retrieval head past layer 1
+        [(0, 1), (1, 2), (1, 3)],
+    ],
+)
+def test_relevance_matches_attention_of_query_token(monkeypatch, tiny_model, heads):
+    model = tiny_model(heads)
+    layers = model.model.layers
+    # Record each attention module's inputs to recompute the scores by hand
+    inputs = {}
+
+    def make_recorder(idx):
+        def record(module, args, kwargs):
+            inputs[idx] = (kwargs["hidden_states"], kwargs["position_embeddings"])
+        return record
+
+    handles = [
+        layer.self_attn.register_forward_pre_hook(make_recorder(idx), with_kwargs=True)
+        for idx, layer in enumerate(layers)
+    ]
+    captured = {}
+    topk = torch.topk
+
+    def spy_topk(relevance, k, **kwargs):
+        captured["relevance"] = relevance.clone()
+        return topk(relevance, k, **kwargs)
+
+    monkeypatch.setattr(torch, "topk", spy_topk)
+    try:
+        condensed, before, after = qr_retriever.reduce("what colour", "ABCDEFGHIJ" * 4, top_k=8)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    assert after == 8 and len(condensed) == 8
+    deepest = max(layer_idx % len(layers) for layer_idx, _ in heads)
+    # Layers after the deepest retrieval layer are skipped
+    assert sorted(inputs) == list(range(deepest + 1))
+
+    expected = torch.zeros(before)
+    with torch.inference_mode():
+        for layer_idx, head in heads:
+            attn = layers[layer_idx % len(layers)].self_attn
+            hidden, (cos, sin) = inputs[layer_idx % len(layers)]
+            q = attn.q_proj(hidden).view(1, before, -1, attn.head_dim).transpose(1, 2)
+            k = attn.k_proj(hidden).view(1, before, -1, attn.head_dim).transpose(1, 2)
+            q, k = apply_rotary_pos_emb(q, k, cos, sin)
+            key = k[0, head // attn.num_key_value_groups]
+            expected += (key @ q[0, head, 0] / attn.head_dim**0.5).softmax(-1)
+    expected /= len(heads)
+
+    relevance = captured["relevance"]
+    context = relevance != -float("inf")
+    assert context.sum().item() == 40
+    assert torch.allclose(relevance[context], expected[context], atol=1e-6)
+
+
+def test_context_within_budget_is_returned_without_running_model(tiny_model):
+    model = tiny_model([(1, 0)])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the model should not run")
+
+    model.forward = fail
+    context = "ABCDEFGH"
+
+    condensed, before, after = qr_retriever.reduce("what colour", context, top_k=8)
+
+    assert condensed == context
+    # BOS, query and separator precede the context
+    assert after == len(context)
+    assert before == 1 + len("what colour") + len(qr_retriever._SEP) + len(context)
+
+
+def test_trailing_special_tokens_are_not_part_of_the_context(tiny_model):
+    tiny_model([], StubTokenizer(eos=True))
+    assert qr_retriever._separator_ids()[1:] == (1, 1)
+
+    condensed, _, after = qr_retriever.reduce("q", "ABCDEFGH", top_k=8)
+    assert (condensed, after) == ("ABCDEFGH", 8)
+
+    # The naive fallback keeps the first and last halves of the context,
+    # not the EOS token
+    condensed, _, after = qr_retriever.reduce("q", "ABCDEFGHIJ", top_k=4)
+    assert (condensed, after) == ("ABIJ", 4)
+
+
+def test_empty_context_still_counts_query_tokens(tiny_model):
+    model = tiny_model([(1, 0)])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the model should not run")
+
+    model.forward = fail
+
+    condensed, before, after = qr_retriever.reduce("what colour", "", top_k=8)
+
+    assert (condensed, after) == ("", 0)
+    assert before == 1 + len("what colour") + len(qr_retriever._SEP)
+
+
+@pytest.mark.parametrize("layer_idx", [4, -5])
+def test_out_of_range_retrieval_layer_raises(tiny_model, layer_idx):
+    tiny_model([(layer_idx, 0)])
+
+    with pytest.raises(IndexError):
+        qr_retriever.reduce("what colour", "ABCDEFGHIJ" * 4, top_k=8)
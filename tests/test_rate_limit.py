@@ -9,9 +9,9 @@ def test_allows_within_limits(monkeypatch):
     t = 0
 
     def fake_time():
-        return t
+        return t * 1_000_000_000
 
-    monkeypatch.setattr(rl, "time", fake_time)
+    monkeypatch.setattr(rl, "_now", fake_time)
 
     limiter.check("id", 10)
     t += 1
@@ -23,9 +23,9 @@ def test_blocks_excess_requests(monkeypatch):
     t = 0
 
     def fake_time():
-        return t
+        return t * 1_000_000_000
 
-    monkeypatch.setattr(rl, "time", fake_time)
+    monkeypatch.setattr(rl, "_now", fake_time)
 
     limiter.check("id", 1)
     t += 1
@@ -41,11 +41,110 @@ def test_blocks_excess_tokens(monkeypatch):
     t = 0
 
     def fake_time():
-        return t
+        return t * 1_000_000_000
 
-    monkeypatch.setattr(rl, "time", fake_time)
+    monkeypatch.setattr(rl, "_now", fake_time)
 
     limiter.check("id", 60)
     t += 1
     with pytest.raises(HTTPException):
         limiter.check("id", 50)
+
+
+def test_refills_over_time(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=2, tokens_per_minute=100)
+    t = 0
+
+    def fake_time():
+        return t * 1_000_000_000
+
+    monkeypatch.setattr(rl, "_now", fake_time)
+
+    limiter.check("id", 50)
+    limiter.check("id", 50)
+    # Half a window refills half of each allowance
+    t += 30
+    limiter.check("id", 50)
+    with pytest.raises(HTTPException):
+        limiter.check("id", 1)
+
+
+def test_evicts_least_recently_used_identity(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=1, tokens_per_minute=100)
+    monkeypatch.setattr(rl, "_now", lambda: 0)
+    limiter._max_identities = 2
+
+    limiter.check("a", 1)
+    limiter.check("b", 1)
+    limiter.check("c", 1)
+    # "a" was evicted, so it starts again with a full bucket
+    limiter.check("a", 1)
+    with pytest.raises(HTTPException):
+        limiter.check("c", 1)
+
+
+def test_retry_after_reflects_refill_time(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=2, tokens_per_minute=100)
+    t = 0
+
+    def fake_time():
+        return t * 1_000_000_000
+
+    monkeypatch.setattr(rl, "_now", fake_time)
+
+    limiter.check("id", 1)
+    limiter.check("id", 1)
+    t += 10
+    # One request refills every 30 seconds; a third of it is back already
+    with pytest.raises(HTTPException) as exc:
+        limiter.check("id", 1)
+    assert exc.value.headers["Retry-After"] == "20"
+
+
+def test_refill_is_exact_over_many_small_steps(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=60, tokens_per_minute=100_000)
+    t = 0
+    monkeypatch.setattr(rl, "_now", lambda: t)
+
+    for _ in range(60):
+        limiter.check("id", 1)
+    # One request refills per second; checking every millisecond must not
+    # lose any of it to rounding
+    for _ in range(999):
+        t += 1_000_000
+        with pytest.raises(HTTPException):
+            limiter.check("id", 1)
+    t += 1_000_000
+    limiter.check("id", 1)
+
+
+def test_sweeps_idle_identities(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=1, tokens_per_minute=100)
+    t = 0
+
+    def fake_time():
+        return t * 1_000_000_000
+
+    monkeypatch.setattr(rl, "_now", fake_time)
+
+    for identity in ("a", "b", "c"):
+        limiter.check(identity, 1)
+    t += 60
+    # Each check reclaims a bounded number of idle buckets
+    limiter.check("d", 1)
+    assert list(limiter._store) == ["c", "d"]
+    t += 1
+    limiter.check("e", 1)
+    assert list(limiter._store) == ["d", "e"]
+
+
+def test_rejects_request_larger_than_token_limit(monkeypatch):
+    limiter = rl.RateLimiter(requests_per_minute=2, tokens_per_minute=100)
+    monkeypatch.setattr(rl, "_now", lambda: 0)
+
+    with pytest.raises(HTTPException) as exc:
+        limiter.check("id", 101)
+    assert exc.value.status_code == 413
+    assert "Retry-After" not in (exc.value.headers or {})
+    # The rejected request consumed nothing
+    limiter.check("id", 100)
@@ -1,70 +1,50 @@
-import pytest
-
-from app import upstream, config
 import httpx
+import orjson
 
+from app import config, upstream
 
-@pytest.mark.asyncio
-async def test_call_llm_uses_env_api_key(monkeypatch):
-    monkeypatch.setenv("UPSTREAM_API_KEY", "secret")
-    config.get_settings.cache_clear()
-    captured = {}
-
-    class DummyResponse:
-        def raise_for_status(self):
-            pass
-
-        def json(self):
-            return {"ok": True}
-
-    class DummyClient:
-        def __init__(self, *args, **kwargs):
-            pass
 
-        async def __aenter__(self):
-            return self
-
-        async def __aexit__(self, exc_type, exc, tb):
-            pass
-
-        async def post(self, url, headers=None, json=None):
-            captured["headers"] = headers
-            return DummyResponse()
-
-    monkeypatch.setattr(httpx, "AsyncClient", DummyClient)
+async def test_call_llm_uses_env_api_key(settings, mock_upstream):
+    settings.upstream_api_key = "secret"
 
     result = await upstream.call_llm(messages=[{"role": "user", "content": "hi"}])
-    assert result == {"ok": True}
-    assert captured["headers"]["Authorization"] == "secret"
-
+    assert orjson.loads(result) == {"ok": True}
+    request = mock_upstream.requests[0]
+    assert request.headers["Authorization"] == "secret"
+    assert str(request.url) == settings.upstream_url
 
-@pytest.mark.asyncio
-async def test_call_llm_streams(monkeypatch):
-    class StreamResponse:
-        def raise_for_status(self):
-            pass
 
-        async def aiter_lines(self):
-            for line in ['data: {"delta": "hi"}', '', 'data: [DONE]']:
-                yield line
+async def test_call_llm_uses_passed_settings(mock_upstream):
+    settings = config.Settings(upstream_base="https://example.test/", upstream_api_key="other")
 
-    class DummyClient:
-        def __init__(self, *args, **kwargs):
-            pass
+    await upstream.call_llm(messages=[{"role": "user", "content": "hi"}], settings=settings)
+    request = mock_upstream.requests[0]
+    assert str(request.url) == "https://example.test/v1/chat/completions"
+    assert request.headers["Authorization"] == "other"
 
-        async def __aenter__(self):
-            return self
 
-        async def __aexit__(self, exc_type, exc, tb):
-            pass
+async def test_call_llm_streams(mock_upstream):
+    body = [b'data: {"delta": "hi"}\n\n', b"data: [DONE]\n\n"]
 
-        async def post(self, url, headers=None, json=None):
-            return StreamResponse()
+    async def stream():
+        for chunk in body:
+            yield chunk
 
-    monkeypatch.setattr(httpx, "AsyncClient", DummyClient)
+    mock_upstream.response = httpx.Response(200, content=stream())
 
     gen = await upstream.call_llm(messages=[{"role": "u", "content": "h"}], stream=True)
-    events = []
-    async for event in gen:
-        events.append(event)
-    assert events == [{"delta": "hi"}]
+    chunks = []
+    async for chunk in gen:
+        chunks.append(chunk)
+    assert chunks == body
+    assert mock_upstream.response.is_closed
+    assert orjson.loads(mock_upstream.requests[0].content)["stream"] is True
+
+
+async def test_client_is_shared_until_closed():
+    client = upstream._get_client()
+    assert upstream._get_client() is client
+    await upstream.close_client()
+    assert client.is_closed
+    assert upstream._get_client() is not client
+    await upstream.close_client()